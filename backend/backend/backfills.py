@@ -1,18 +1,29 @@
+import hashlib
+import json
 import logging as _logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from time import time
+from xml.etree import ElementTree
 
-import feedparser
-import opml
+import requests
+from sqlalchemy import insert, update
 
 from backend.engine import session_scope
 from backend.env_vars import DATA_FOLDER
+from backend.files import write_atomically
 from backend.logging import logging
-from backend.models import Channel
+from backend.models import Channel, YoutubeVideo
 from backend.repo import get_all_channels, get_real_all_videos
 
 logger = logging.getLogger(__name__)
 logger.setLevel(_logging.INFO)
 
+FEED_CACHE_FOLDER = f"{DATA_FOLDER}/feed_cache"
+ATOM_NAMESPACE = "http://www.w3.org/2005/Atom"
+YT_NAMESPACE = "http://www.youtube.com/xml/schemas/2015"
+INSERT_BATCH_SIZE = 1000
+
 
 def backfill_channels():
     """
@@ -21,54 +32,169 @@ def backfill_channels():
     :return: A dictionary containing channel names as keys and their video data as values.
     :rtype: dict
     """
-    data = open(f"{DATA_FOLDER}/subscription_manager", "r")
-    nested = opml.parse(data)
-
-    channels = [channel for channel in nested[0]]
-    new_channels = []
+    subscriptions = read_subscriptions(f"{DATA_FOLDER}/subscription_manager")
     titles = []
-    for channel in channels:
-        try:
-            channel_feed = feedparser.parse(channel.xmlUrl)
-            channel_id = "UC" + channel_feed["feed"]["yt_channelid"]
-            channel_urls = channel_feed["feed"]["links"]
-            channel_url = [a["href"] for a in channel_urls if a["rel"] == "alternate"][
-                0
-            ]
-            channel_name = channel_feed["feed"]["title"]
-
-            new_channels.append(
-                (
-                    Channel(
-                        channel_id=channel_id,
-                        channel_url=channel_url,
-                        channel_name=channel_name,
-                        inserted_at=int(time()),
-                    ),
-                    channel.title,
-                )
-            )
-            titles.append((channel_name, channel.title))
-        except Exception:
-            logger.error(f"Failed to add channel {channel.title}")
 
-    with session_scope() as session:
-        session.add_all([a[0] for a in new_channels])
+    with session_scope() as session, ThreadPoolExecutor(max_workers=32) as executor:
+        batch = []
+        for result in executor.map(get_channel_info, subscriptions):
+            if result is None:
+                continue
+            channel_values, title = result
+            batch.append(channel_values)
+            titles.append(title)
+            if len(batch) >= INSERT_BATCH_SIZE:
+                session.execute(insert(Channel), batch)
+                batch = []
+
+        if batch:
+            session.execute(insert(Channel), batch)
         session.commit()
 
     return titles
 
 
+def read_subscriptions(path):
+    """
+    Stream the channel outlines of the OPML subscription file.
+
+    :param path: The path to the OPML file.
+    :type path: str
+    :return: A generator of (xml_url, title) tuples, one per subscribed channel.
+    :rtype: generator
+    """
+    for _, element in ElementTree.iterparse(path, events=("end",)):
+        if element.tag != "outline":
+            continue
+        xml_url = element.get("xmlUrl")
+        if xml_url:
+            yield xml_url, element.get("title")
+        element.clear()
+
+
+def get_channel_info(subscription):
+    """
+    Fetch the feed of a channel and build the column values of its Channel.
+
+    :param subscription: The (xml_url, title) tuple of the channel in the OPML file.
+    :type subscription: tuple
+    :return: A tuple with the Channel values and a (channel_name, title) pair, or None on failure.
+    :rtype: tuple
+    """
+    xml_url, title = subscription
+    try:
+        channel_feed = parse_channel_feed(fetch_feed(xml_url))
+    except (requests.RequestException, ElementTree.ParseError, OSError) as error:
+        logger.error(f"Failed to fetch the feed of channel {title}", error)
+        return None
+
+    channel_url = next(
+        (a["href"] for a in channel_feed["links"] if a["rel"] == "alternate"), None
+    )
+    if channel_feed["yt_channelid"] is None or channel_url is None:
+        logger.error(f"Failed to add channel {title}, its feed is incomplete")
+        return None
+    channel_name = channel_feed["title"]
+
+    return (
+        {
+            "channel_id": "UC" + channel_feed["yt_channelid"],
+            "channel_url": channel_url,
+            "channel_name": channel_name,
+            "inserted_at": int(time()),
+        },
+        (channel_name, title),
+    )
+
+
+def parse_channel_feed(content):
+    """
+    Read the channel level fields of a YouTube feed.
+
+    Only the channel id, links and title are needed, so the XML is read directly instead
+    of going through feedparser and its sanitization passes.
+
+    :param content: The raw feed XML.
+    :type content: bytes
+    :return: A dictionary with the yt_channelid, links and title of the feed.
+    :rtype: dict
+    """
+    root = ElementTree.fromstring(content)
+    return {
+        "yt_channelid": root.findtext(f"{{{YT_NAMESPACE}}}channelId"),
+        "links": [
+            {"rel": link.get("rel"), "href": link.get("href")}
+            for link in root.findall(f"{{{ATOM_NAMESPACE}}}link")
+        ],
+        "title": root.findtext(f"{{{ATOM_NAMESPACE}}}title"),
+    }
+
+
+def fetch_feed(url):
+    """
+    Fetch the raw XML of a feed, using a disk cache and a conditional GET.
+
+    The ETag/Last-Modified headers of the last response are stored next to the cached XML
+    so reruns only download feeds that actually changed.
+
+    :param url: The feed URL.
+    :type url: str
+    :return: The raw feed XML.
+    :rtype: bytes
+    """
+    key = hashlib.sha1(url.encode()).hexdigest()
+    xml_path = f"{FEED_CACHE_FOLDER}/{key}.xml"
+    headers_path = f"{FEED_CACHE_FOLDER}/{key}.json"
+
+    request_headers = {}
+    if os.path.exists(xml_path) and os.path.exists(headers_path):
+        try:
+            with open(headers_path, "r") as f:
+                cached_headers = json.load(f)
+        except (OSError, ValueError) as error:
+            # an unreadable cache entry is a miss, the feed is fetched in full
+            logger.error(f"Failed to read the cached headers of {url}", error)
+            cached_headers = {}
+        if cached_headers.get("etag"):
+            request_headers["If-None-Match"] = cached_headers["etag"]
+        if cached_headers.get("modified"):
+            request_headers["If-Modified-Since"] = cached_headers["modified"]
+
+    response = requests.get(url, headers=request_headers, timeout=30)
+    if response.status_code == 304:
+        with open(xml_path, "rb") as f:
+            return f.read()
+    response.raise_for_status()
+
+    os.makedirs(FEED_CACHE_FOLDER, exist_ok=True)
+    write_atomically(xml_path, response.content)
+    write_atomically(
+        headers_path,
+        json.dumps(
+            {
+                "etag": response.headers.get("ETag"),
+                "modified": response.headers.get("Last-Modified"),
+            }
+        ).encode(),
+    )
+    return response.content
+
+
 def backfill_video_channels(titles):
     with session_scope() as session:
-        videos = [x[0] for x in get_real_all_videos(session)]
-        channels = [x[0] for x in get_all_channels()]
+        videos = get_real_all_videos(session)
+        channels = get_all_channels(session)
 
+        title_to_name = {title: channel_name for channel_name, title in titles}
+        name_to_channel_id = {c.channel_name: c.id for c in channels}
+
+        mappings = []
         for video in videos:
-            yt_cuck_title = video.channel
-            channel_name = [c[0] for c in titles if c[1] == yt_cuck_title][0]
-            for channel in channels:
-                if channel.channel_name == channel_name:
-                    video.channel_id = channel.id
+            channel_id = name_to_channel_id.get(title_to_name.get(video.channel))
+            if channel_id is not None:
+                mappings.append({"id": video.id, "channel_id": channel_id})
+
+        if mappings:
+            session.execute(update(YoutubeVideo), mappings)
         session.commit()
     return
@@ -16,8 +16,10 @@ def close_engine():
     engine.dispose()
 
 
+Session = sessionmaker(bind=engine)
+
+
 def create_session():
-    Session = sessionmaker(bind=engine)
     session = Session()
     return session
 
@@ -11,3 +11,4 @@ DB_PASS = os.getenv("DB_PASS")
 DB_NAME = os.getenv("DB_NAME")
 DB_HOST = os.getenv("DB_HOST")
 DATA_FOLDER = os.getenv("DATA_FOLDER")
+MAX_DOWNLOADS = os.getenv("MAX_DOWNLOADS")
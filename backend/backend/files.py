@@ -0,0 +1,27 @@
+import os
+import tempfile
+
+
+def write_atomically(path, content):
+    """
+    Write a file through a temporary file and an atomic rename.
+
+    Readers, like nginx serving thumbnails, either see the old file or the complete new one,
+    never a partially written one. Each call gets its own temporary file, so concurrent
+    writers of the same path do not clobber each other.
+
+    :param path: The final path of the file.
+    :type path: str
+    :param content: The content to write.
+    :type content: bytes
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        # mkstemp creates the file readable by its owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -32,6 +32,16 @@ class YoutubeVideo(Base):
     index_pub_date = Index("idx_pub_date", pub_date)
     index_downloaded_at = Index("idx_downloaded_at", downloaded_at)
     composite_index = Index("idx_filter_conditions", vid_path, short)
+    index_channel_id = Index("idx_channel_id", channel_id)
+    index_pending_livestreams = Index(
+        "idx_pending_livestreams", livestream, downloaded_at, inserted_at
+    )
+    index_expiration = Index("idx_expiration", keep, pub_date)
+    index_recent_videos = Index("idx_recent_videos", short, downloaded_at)
+    index_recent_shorts = Index(
+        "idx_recent_shorts", short, livestream, pub_date, vid_path
+    )
+    index_unsized = Index("idx_unsized", size, vid_path)
 
 
 class JsonData(Base):
@@ -1,8 +1,10 @@
-import json
+import hashlib
 import logging as _logging
 from time import time
 
-from sqlalchemy import and_, select
+import orjson
+from sqlalchemy import and_, bindparam, false, select, true, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 
 from backend.constants import LIVE_DELAY
 from backend.engine import session_scope
@@ -12,17 +14,26 @@ from backend.models import Channel, JsonData, RSSFeedDate, YoutubeVideo
 logger = logging.getLogger(__name__)
 logger.setLevel(_logging.INFO)
 
+URL_LOOKUP_BATCH_SIZE = 1000
 
-def expire_video(identifier):
+# digest of the last rss feed json written
+json_digest = None
+
+
+def expire_videos(identifiers):
+    if not identifiers:
+        return
     try:
         with session_scope() as session:
-            updated_rec = session.query(YoutubeVideo).filter_by(id=identifier).first()
-            updated_rec.vid_path = "NA"
-            updated_rec.thumb_path = "NA"
+            session.execute(
+                update(YoutubeVideo)
+                .where(YoutubeVideo.id.in_(identifiers))
+                .values(vid_path="NA", thumb_path="NA")
+            )
             session.commit()
     except Exception as error:
         logger.error(
-            f"Failed to update downloaded_videos table with id={identifier}", error
+            f"Failed to update downloaded_videos table with ids={identifiers}", error
         )
 
 
@@ -30,10 +41,12 @@ def get_expired_videos(date):
     try:
         with session_scope() as session:
             data = (
-                session.query(YoutubeVideo)
+                session.query(
+                    YoutubeVideo.id, YoutubeVideo.vid_path, YoutubeVideo.thumb_path
+                )
+                .filter(YoutubeVideo.keep == false())
                 .filter(YoutubeVideo.pub_date < date)
                 .filter(YoutubeVideo.vid_path != "NA")
-                .filter(YoutubeVideo.keep.is_(False))
                 .all()
             )
             return data
@@ -44,36 +57,48 @@ def get_expired_videos(date):
         return []
 
 
-def update_view_count(video_data):
+def update_view_counts(videos_data):
+    """
+    Update the view count of many videos in a single executemany statement.
+
+    :param videos_data: The RSS data of each video, with its video_url and views.
+    :type videos_data: list
+    """
+    if not videos_data:
+        return
     try:
         with session_scope() as session:
-            url = video_data["video_url"]
-            views = int(video_data["views"])
-            rating = float(video_data["rating"])
-            vid = session.query(YoutubeVideo).filter_by(vid_url=url).first()
-            vid.views = views
-            vid.rating = rating
+            # a Core executemany, the ORM bulk update only matches rows by primary key
+            session.connection().execute(
+                update(YoutubeVideo)
+                .where(YoutubeVideo.vid_url == bindparam("b_vid_url"))
+                .values(views=bindparam("b_views")),
+                [
+                    {"b_vid_url": video["video_url"], "b_views": int(video["views"])}
+                    for video in videos_data
+                ],
+            )
             session.commit()
     except Exception as error:
         logger.error(
-            f"Failed to update downloaded_videos table with vid_url={video_data['video_url']}",
-            error,
+            f"Failed to update the view count of {len(videos_data)} videos", error
         )
 
 
 def update_rss_date(date_str):
     try:
         with session_scope() as session:
-            data = (
-                session.query(RSSFeedDate)
-                .order_by(RSSFeedDate.id.desc())
-                .limit(1)
-                .all()
+            latest_id = session.scalar(
+                select(RSSFeedDate.id).order_by(RSSFeedDate.id.desc()).limit(1)
             )
-            if data == []:
+            if latest_id is None:
                 insert_rss_date(session, date_str)
             else:
-                data[0].date_human = date_str
+                session.execute(
+                    update(RSSFeedDate)
+                    .where(RSSFeedDate.id == latest_id)
+                    .values(date_human=date_str)
+                )
             session.commit()
     except Exception as error:
         logger.error("Failed to update rss_feed_date table", error)
@@ -86,50 +111,97 @@ def insert_rss_date(session, date_str):
         logger.error("Failed to insert video into downloaded_videos table", error)
 
 
-def get_json():
-    try:
-        with session_scope() as session:
-            data = session.query(JsonData).order_by(JsonData.id.desc()).limit(1).first()
-            if data:
-                return data.rss_feed_json
-            return data
-    except Exception as error:
-        logger.error("Failed to select recent videos from json_data table", error)
-        return []
-
-
 def update_json(json_data):
+    global json_digest
     try:
+        rss_feed_bytes = orjson.dumps(json_data)
+        digest = hashlib.blake2b(rss_feed_bytes, digest_size=16).digest()
+        if digest == json_digest:
+            return
+        rss_feed_json = rss_feed_bytes.decode()
         with session_scope() as session:
-            data = session.query(JsonData).order_by(JsonData.id.desc()).limit(1).all()
-            if data == []:
-                insert_json(json.dumps(json_data))
+            latest_id = session.scalar(
+                select(JsonData.id).order_by(JsonData.id.desc()).limit(1)
+            )
+            if latest_id is None:
+                insert_json(session, rss_feed_json)
             else:
-                data[0].rss_feed_json = json.dumps(json_data)
+                session.execute(
+                    update(JsonData)
+                    .where(JsonData.id == latest_id)
+                    .values(rss_feed_json=rss_feed_json)
+                )
             session.commit()
+        json_digest = digest
     except Exception as error:
         logger.error("Failed to update json_data table", error)
 
 
-def insert_json(json_data):
+def insert_json(session, json_data):
     try:
-        with session_scope() as session:
-            session.add(JsonData(rss_feed_json=json_data))
-            session.commit()
+        session.add(JsonData(rss_feed_json=json_data))
     except Exception as error:
         logger.error("Failed to insert jsondata into JsonData table", error)
 
 
-def get_downloaded_video_urls():
+def get_downloaded_video_urls(video_urls):
+    """
+    Find which of the given video urls are already in the database.
+
+    Only the urls of the current feed are looked up, through the unique index on vid_url,
+    instead of loading every url of the table.
+
+    :param video_urls: The urls to look up.
+    :type video_urls: iterable
+    :return: The subset of the urls that already have a row.
+    :rtype: set
+    """
+    video_urls = list(video_urls)
     try:
         with session_scope() as session:
-            down_vid_urls = [
-                res[0] for res in session.execute(select(YoutubeVideo.vid_url)).all()
-            ]
+            down_vid_urls = set()
+            for start in range(0, len(video_urls), URL_LOOKUP_BATCH_SIZE):
+                end = start + URL_LOOKUP_BATCH_SIZE
+                down_vid_urls.update(
+                    session.scalars(
+                        select(YoutubeVideo.vid_url).where(
+                            YoutubeVideo.vid_url.in_(video_urls[start:end])
+                        )
+                    )
+                )
             return down_vid_urls
     except Exception as error:
         logger.error("Failed to get downloaded video urls", error)
-        return []
+        return set()
+
+
+def upsert_video(video_values):
+    """
+    Insert a video, or update the existing row with the same vid_url, in one statement.
+
+    :param video_values: The YoutubeVideo column values, must include vid_url.
+    :type video_values: dict
+    :return: True if the statement succeeded, False otherwise.
+    :rtype: bool
+    """
+    try:
+        with session_scope() as session:
+            statement = mysql_insert(YoutubeVideo).values(**video_values)
+            statement = statement.on_duplicate_key_update(
+                {
+                    key: statement.inserted[key]
+                    for key in video_values
+                    if key not in ("vid_url", "inserted_at")
+                }
+            )
+            session.execute(statement)
+            session.commit()
+            return True
+    except Exception as error:
+        logger.error(
+            f"Failed to upsert video with vid_url={video_values['vid_url']}", error
+        )
+        return False
 
 
 def get_livestream_videos():
@@ -138,8 +210,13 @@ def get_livestream_videos():
     try:
         with session_scope() as session:
             data = session.execute(
-                select(YoutubeVideo)
-                .where(YoutubeVideo.livestream)
+                select(
+                    YoutubeVideo.id,
+                    YoutubeVideo.vid_url,
+                    YoutubeVideo.thumb_url,
+                    YoutubeVideo.title,
+                )
+                .where(YoutubeVideo.livestream == true())
                 .where(YoutubeVideo.downloaded_at.is_(None))
                 .where(YoutubeVideo.inserted_at < time_now - 43200)
                 .where(YoutubeVideo.inserted_at > time_now - LIVE_DELAY)
@@ -153,7 +230,7 @@ def get_livestream_videos():
 def get_all_videos():
     try:
         with session_scope() as session:
-            data = session.execute(
+            data = session.scalars(
                 select(YoutubeVideo)
                 .where(
                     and_(
@@ -169,29 +246,30 @@ def get_all_videos():
 
 
 def get_real_all_videos(session):
-    data = session.execute(
+    data = session.scalars(
         select(YoutubeVideo).where(YoutubeVideo.channel_id.is_(None))
     ).all()
     return data
 
 
-def get_all_channels():
-    try:
-        with session_scope() as session:
-            data = session.execute(select(Channel)).all()
-            return data
-    except Exception as error:
-        logger.error("Failed to get all videos", error)
-        return []
+def get_all_channels(session):
+    data = session.scalars(select(Channel)).all()
+    return data
 
 
 def get_video_by_id(video_id):
     try:
         with session_scope() as session:
             data = session.execute(
-                select(YoutubeVideo).where(YoutubeVideo.id == video_id)
+                select(
+                    YoutubeVideo.id,
+                    YoutubeVideo.vid_url,
+                    YoutubeVideo.vid_path,
+                    YoutubeVideo.thumb_url,
+                    YoutubeVideo.title,
+                ).where(YoutubeVideo.id == video_id)
             ).one()
             return data
     except Exception as error:
-        logger.error("Failed to get all videos", error)
-        return []
+        logger.error(f"Failed to get video with id={video_id}", error)
+        return None
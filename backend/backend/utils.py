@@ -1,42 +1,62 @@
-import json
 import logging as _logging
 import os
+import re
 import threading
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from subprocess import DEVNULL, check_output
 from time import time
+from types import MappingProxyType
 
 import dateutil.parser as date_parser
 import feedparser
 import opml
 import requests
 import yt_dlp
+from sqlalchemy import update
 from yt_dlp.utils import DownloadError
 
 from backend.constants import DELAY, REMOVAL_DELAY
 from backend.engine import session_scope
-from backend.env_vars import DATA_FOLDER
+from backend.env_vars import DATA_FOLDER, MAX_DOWNLOADS
+from backend.files import write_atomically
 from backend.logging import logging
 from backend.models import YoutubeVideo
 from backend.repo import (
-    expire_video,
+    expire_videos,
     get_all_videos,
     get_downloaded_video_urls,
     get_expired_videos,
-    get_json,
     get_livestream_videos,
     get_video_by_id,
     update_json,
     update_rss_date,
-    update_view_count,
+    update_view_counts,
+    upsert_video,
 )
 
 logger = logging.getLogger(__name__)
 logger.setLevel(_logging.INFO)
 
-video_executor = ThreadPoolExecutor(max_workers=4)
-update_count_executor = ThreadPoolExecutor(max_workers=32)
+# number of parallel yt-dlp downloads, 4 unless MAX_DOWNLOADS is set
+video_executor = ThreadPoolExecutor(
+    max_workers=int(MAX_DOWNLOADS) if MAX_DOWNLOADS else 4
+)
+thumbnail_executor = ThreadPoolExecutor(max_workers=4)
+extractor_local = threading.local()
+
+SIZE_UPDATE_BATCH_SIZE = 1000
+
+VIDEO_ID_REGEX = re.compile(r"(?:[?&]v=|/shorts/|youtu\.be/)([A-Za-z0-9_-]{11})")
+
+YT_DLP_OPTIONS = MappingProxyType(
+    {
+        "format": "bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[height<=1080][ext=mp4]",
+        "quiet": True,
+        "overwrites": True,
+        "noprogress": True,
+    }
+)
 
 
 def get_rss_data():
@@ -46,8 +66,8 @@ def get_rss_data():
     :return: A dictionary containing channel names as keys and their video data as values.
     :rtype: dict
     """
-    data = open(f"{DATA_FOLDER}/subscription_manager", "r")
-    nested = opml.parse(data)
+    with open(f"{DATA_FOLDER}/subscription_manager", "r") as data:
+        nested = opml.parse(data)
     all_channels = dict()
 
     with ThreadPoolExecutor(max_workers=8) as rss_executor:
@@ -68,13 +88,26 @@ def remove_old_videos():
     """
     min_pub_date = time() - REMOVAL_DELAY
     records = get_expired_videos(min_pub_date)
+    if not records:
+        return
+
+    videos_folder = f"{DATA_FOLDER}/videos"
+    thumbnails_folder = f"{DATA_FOLDER}/thumbnails"
+
+    # one directory read instead of an exists() call per expired video
+    try:
+        with os.scandir(videos_folder) as entries:
+            existing_videos = {entry.name for entry in entries}
+    except OSError as error:
+        logger.error(f"Failed to list the videos at path: {videos_folder}", error)
+        existing_videos = set()
+
     for expired_video in records:
         try:
-            file_path = os.path.join(f"{DATA_FOLDER}/videos", expired_video.vid_path)
-            if not os.path.exists(file_path):
-                file_path = os.path.join(
-                    f"{DATA_FOLDER}/videos", expired_video.vid_path.split(".")[0]
-                )
+            file_name = expired_video.vid_path
+            if file_name not in existing_videos:
+                file_name = file_name.split(".")[0]
+            file_path = f"{videos_folder}/{file_name}"
             os.remove(file_path)
             logger.info(f"Delete video at path: {file_path}")
 
@@ -82,15 +115,13 @@ def remove_old_videos():
             logger.error(f"Failed to delete video at path: {file_path}")
 
         try:
-            thumb_path = os.path.join(
-                f"{DATA_FOLDER}/thumbnails", expired_video.thumb_path
-            )
+            thumb_path = f"{thumbnails_folder}/{expired_video.thumb_path}"
             os.remove(thumb_path)
             logger.info(f"Delete thumbnail at path: {thumb_path}")
         except Exception:
             logger.error(f"Failed to delete thumbnail at path: {thumb_path}")
 
-        expire_video(expired_video.id)
+    expire_videos([expired_video.id for expired_video in records])
 
 
 def get_rss_feed():
@@ -106,7 +137,7 @@ def get_rss_feed():
     update_rss_date(date_str)
     new_json = get_rss_data()
     update_json(new_json)
-    thread = threading.Thread(target=get_video)
+    thread = threading.Thread(target=get_video, args=(new_json,))
     thread.start()
     return thread
 
@@ -147,32 +178,39 @@ def get_channel_data(channel):
     return channel_data, channel.title
 
 
-def get_video():
+def get_video(json_video_data):
     """
     Download videos from the channels based on the DELAY value.
+
+    :param json_video_data: The freshly fetched RSS data.
+    :type json_video_data: dict
     """
     logger.info("Downloading videos!")
     try:
-        down_vid_urls = get_downloaded_video_urls()
         min_date = time() - DELAY
-        json_video_data = json.loads(get_json())
+        down_vid_urls = get_downloaded_video_urls(
+            video["video_url"]
+            for videos in json_video_data.values()
+            for video in videos
+        )
 
-        futures = []
+        known_videos = []
+        download_futures = []
         for channel in json_video_data.keys():
             for video in json_video_data[channel]:
                 url = video["video_url"]
                 if url in down_vid_urls:
-                    futures.append(
-                        update_count_executor.submit(update_view_count, video)
-                    )
+                    known_videos.append(video)
                     continue
                 if float(video["epoch_date"]) < min_date:
                     continue
-                futures.append(
+                download_futures.append(
                     video_executor.submit(video_download_thread, video, channel)
                 )
 
-        for future in futures:
+        update_view_counts(known_videos)
+
+        for future in download_futures:
             future.result()
 
     except Exception as error:
@@ -202,6 +240,23 @@ def video_type(video_info):
         return "regular video"
 
 
+def get_extractor():
+    """
+    Get the YoutubeDL instance of the current thread used to extract video info.
+
+    YoutubeDL is not thread safe, so every worker thread builds its own instance once and
+    reuses it for all the videos it handles.
+
+    :return: The YoutubeDL instance of this thread.
+    :rtype: yt_dlp.YoutubeDL
+    """
+    extractor = getattr(extractor_local, "extractor", None)
+    if extractor is None:
+        extractor = yt_dlp.YoutubeDL({})
+        extractor_local.extractor = extractor
+    return extractor
+
+
 def extract_video_info(video_url):
     """
     Extracts video information from a given YouTube video URL using the youtube-dl library.
@@ -214,12 +269,9 @@ def extract_video_info(video_url):
                If the extraction was unsuccessful, the boolean value will be False and the video information will be None.
     """
 
-    ydl_opts = {}
-
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            video_info = ydl.extract_info(video_url, download=False)
-            return video_info
+        video_info = get_extractor().extract_info(video_url, download=False)
+        return video_info
     except DownloadError as error:
         logger.error(f"Failed to extract video info for {video_url}", error)
         return None
@@ -237,77 +289,88 @@ def video_download_thread(video, channel):
     try:
         video_info = extract_video_info(video["video_url"])
 
-        type = video_type(video_info)
-
-        video_object = None
-
-        if type in ["livestream", "premiere"]:
-            video_object = YoutubeVideo(
-                vid_url=video["video_url"],
-                thumb_url=video["thumbnail"],
-                pub_date=int(video["epoch_date"]),
-                pub_date_human=video["human_date"],
-                title=video["title"],
-                views=int(video["views"]),
-                description=video["description"],
-                channel=channel,
-                livestream=True,
-                short=False,
-                inserted_at=int(time()),
-            )
+        video_type_result = video_type(video_info)
+        is_short = video_type_result == "short"
+
+        if video_type_result in ("livestream", "premiere"):
+            video_values = {
+                "vid_url": video["video_url"],
+                "thumb_url": video["thumbnail"],
+                "pub_date": int(video["epoch_date"]),
+                "pub_date_human": video["human_date"],
+                "title": video["title"],
+                "views": int(video["views"]),
+                "description": video["description"],
+                "channel": channel,
+                "livestream": True,
+                "short": False,
+                "inserted_at": int(time()),
+            }
         else:
-            file_name = video["video_url"].split("=")[1]
+            file_name = get_video_id(video["video_url"])
+            if file_name is None:
+                logger.error(f"Failed to get the video id of {video['video_url']}")
+                return
+
+            vid_path = f"{file_name}.mp4"
+            thumb_path = f"{file_name}.jpg"
+
+            # the thumbnail is fetched while yt-dlp downloads the video
+            thumb_future = thumbnail_executor.submit(
+                download_thumbnail, video["thumbnail"], thumb_path
+            )
 
             download_video(video["video_url"], file_name)
 
             now = int(time())
 
             if not confirm_video_name(file_name):
+                discard_thumbnail(thumb_future, thumb_path)
                 return
 
-            vid_path = f"{file_name}.mp4"
-            thumb_path = f"{file_name}.jpg"
-
-            download_thumbnail(video["thumbnail"], thumb_path)
+            thumb_future.result()
 
             size = get_video_size(vid_path)
 
-            video_object = YoutubeVideo(
-                vid_url=video["video_url"],
-                vid_path=vid_path,
-                thumb_url=video["thumbnail"],
-                thumb_path=thumb_path,
-                pub_date=int(video["epoch_date"]),
-                pub_date_human=video["human_date"],
-                title=video["title"],
-                views=int(video["views"]),
-                description=video["description"],
-                channel=channel,
-                livestream=False,
-                short=type == "short",
-                inserted_at=now,
-                downloaded_at=now,
-                size=size,
-            )
-
-        with session_scope() as session:
-            try:
-                session.add(video_object)
-                session.commit()
-                logger.info(
-                    f"Video - {video['title']} from channel {channel} was added."
-                )
-            except Exception as error:
-                logger.error(
-                    "Failed to insert the Youtube video into the YoutubeVideo table",
-                    error,
-                )
+            video_values = {
+                "vid_url": video["video_url"],
+                "vid_path": vid_path,
+                "thumb_url": video["thumbnail"],
+                "thumb_path": thumb_path,
+                "pub_date": int(video["epoch_date"]),
+                "pub_date_human": video["human_date"],
+                "title": video["title"],
+                "views": int(video["views"]),
+                "description": video["description"],
+                "channel": channel,
+                "livestream": False,
+                "short": is_short,
+                "inserted_at": now,
+                "downloaded_at": now,
+                "size": size,
+            }
+
+        if upsert_video(video_values):
+            logger.info(f"Video - {video['title']} from channel {channel} was added.")
     except Exception as error:
         logger.error(
             "Failed at some point in the video_download_thread function", error
         )
 
 
+def get_video_id(video_url):
+    """
+    Extract the 11 character YouTube video id from a video url.
+
+    :param video_url: A watch, shorts or youtu.be url.
+    :type video_url: str
+    :return: The video id, or None if the url has none.
+    :rtype: str
+    """
+    match = VIDEO_ID_REGEX.search(video_url)
+    return match.group(1) if match else None
+
+
 def confirm_video_name(filename):
     path = f"{DATA_FOLDER}/videos/{filename}.mp4"
     if os.path.exists(path):
@@ -322,8 +385,28 @@ def confirm_video_name(filename):
 
 def download_thumbnail(url, filename):
     r = requests.get(url)
-    with open(f"{DATA_FOLDER}/thumbnails/{filename}", "wb") as f:
-        f.write(r.content)
+    write_atomically(f"{DATA_FOLDER}/thumbnails/{filename}", r.content)
+
+
+def discard_thumbnail(thumb_future, filename):
+    """
+    Drop the thumbnail of a video whose download failed, so no file is left without a row.
+
+    :param thumb_future: The future of the download_thumbnail call.
+    :type thumb_future: concurrent.futures.Future
+    :param filename: The file name of the thumbnail.
+    :type filename: str
+    """
+    if thumb_future.cancel():
+        return
+    try:
+        thumb_future.result()
+    except Exception as error:
+        logger.error(f"Failed to download thumbnail {filename}", error)
+    try:
+        os.remove(f"{DATA_FOLDER}/thumbnails/{filename}")
+    except FileNotFoundError:
+        pass
 
 
 def get_queue_size():
@@ -340,7 +423,7 @@ def download_old_livestreams():
     :return: None
     """
     logger.info("Starting download of old livestreams...")
-    old_livestreams = [x[0] for x in get_livestream_videos()]
+    old_livestreams = get_livestream_videos()
     futures = []
     for livestream in old_livestreams:
         try:
@@ -360,32 +443,41 @@ def livestream_download_thread(video):
     """
     Download a livestream and its thumbnail and update the database.
 
-    :param video: A YoutubeVideo object containing all livestream data.
-    :type video: YoutubeVideo
+    :param video: A row with the id, vid_url, thumb_url and title of the livestream.
+    :type video: Row
     """
-    file_name = video.vid_url.split("=")[1]
+    file_name = get_video_id(video.vid_url)
+    if file_name is None:
+        logger.error(f"Failed to get the video id of {video.vid_url}")
+        return
+
+    vid_path = f"{file_name}.mp4"
+    thumb_path = f"{file_name}.jpg"
+
+    thumb_future = thumbnail_executor.submit(
+        download_thumbnail, video.thumb_url, thumb_path
+    )
 
     if download_video(video.vid_url, file_name) != 0:
+        discard_thumbnail(thumb_future, thumb_path)
         logger.error(f"YT_DLP Failed to download_video for video {video.vid_url}")
         return
 
     if not confirm_video_name(file_name):
+        discard_thumbnail(thumb_future, thumb_path)
         logger.error(f"Failed to confirm_video_name for video {video.vid_url}")
         return
 
-    video.vid_path = f"{file_name}.mp4"
-    video.thumb_path = f"{file_name}.jpg"
-
-    download_thumbnail(video.thumb_url, video.thumb_path)
-    size = get_video_size(video.vid_path)
+    thumb_future.result()
+    size = get_video_size(vid_path)
 
     with session_scope() as session:
         try:
             # Update the video record in the database.
             session.query(YoutubeVideo).filter(YoutubeVideo.id == video.id).update(
                 {
-                    "vid_path": video.vid_path,
-                    "thumb_path": video.thumb_path,
+                    "vid_path": vid_path,
+                    "thumb_path": thumb_path,
                     "downloaded_at": int(time()),
                     "size": size,
                 }
@@ -405,41 +497,48 @@ def update_size_for_old_videos():
     """
     logger.info("Updating size for old videos")
     all_videos = get_all_videos()
-    for video in [x[0] for x in all_videos]:
+    sizes = []
+    for video in all_videos:
         try:
-            video_size = get_video_size(video.vid_path)
-            with session_scope() as session:
-                session.query(YoutubeVideo).filter(YoutubeVideo.id == video.id).update(
-                    {"size": video_size}
-                )
-                session.commit()
-            logger.info(f"Video size for {video.title} was updated with {video_size}s")
+            sizes.append({"id": video.id, "size": get_video_size(video.vid_path)})
         except Exception as error:
             logger.error(
-                f"Failed to update size for video {video.title} at path {video.vid_path}",
+                f"Failed to get size for video {video.title} at path {video.vid_path}",
                 error,
             )
 
+    with session_scope() as session:
+        for start in range(0, len(sizes), SIZE_UPDATE_BATCH_SIZE):
+            end = start + SIZE_UPDATE_BATCH_SIZE
+            batch = sizes[start:end]
+            try:
+                session.execute(update(YoutubeVideo), batch)
+                session.commit()
+                logger.info(f"Video size was updated for {len(batch)} videos")
+            except Exception as error:
+                session.rollback()
+                logger.error(f"Failed to update size for {len(batch)} videos", error)
+
 
 def get_video_size(video_path):
     output = check_output(
-        f"ffprobe {DATA_FOLDER}/videos/{video_path} -show_format",
-        shell=True,
+        [
+            "ffprobe",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            f"{DATA_FOLDER}/videos/{video_path}",
+        ],
         universal_newlines=True,
         stderr=DEVNULL,
     )
 
-    return int(float(output.split("duration=")[1].split("\n")[0]))
+    return int(float(output))
 
 
 def download_video(url, filename):
-    options = {
-        "format": "bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[height<=1080][ext=mp4]",
-        "outtmpl": f"{DATA_FOLDER}/videos/{filename}.mp4",
-        "quiet": True,
-        "overwrites": True,
-        "noprogress": True,
-    }
+    options = {**YT_DLP_OPTIONS, "outtmpl": f"{DATA_FOLDER}/videos/{filename}.mp4"}
 
     try:
         with yt_dlp.YoutubeDL(options) as ydl:
@@ -460,12 +559,19 @@ def download_and_keep(video_id):
     :type video_id: str
     """
 
-    video = get_video_by_id(video_id)[0]
-    is_missing = video.vid_path == "NA"
+    video = get_video_by_id(video_id)
+    if video is None:
+        return
+
+    # only the keep flag changes when the video is still on disk
+    values = {"keep": True}
 
-    file_name = video.vid_url.split("=")[1]
+    if video.vid_path == "NA":
+        file_name = get_video_id(video.vid_url)
+        if file_name is None:
+            logger.error(f"Failed to get the video id of {video.vid_url}")
+            return
 
-    if is_missing:
         if download_video(video.vid_url, file_name) != 0:
             logger.error(f"YT_DLP Failed to download_video for video {video.vid_url}")
             return
@@ -474,22 +580,17 @@ def download_and_keep(video_id):
             logger.error(f"Failed to confirm_video_name for video {video.vid_url}")
             return
 
-        video.vid_path = f"{file_name}.mp4"
-        video.thumb_path = f"{file_name}.jpg"
+        values["vid_path"] = f"{file_name}.mp4"
+        values["thumb_path"] = f"{file_name}.jpg"
 
-        download_thumbnail(video.thumb_url, video.thumb_path)
-        size = get_video_size(video.vid_path)
+        download_thumbnail(video.thumb_url, values["thumb_path"])
+        values["size"] = get_video_size(values["vid_path"])
+        values["downloaded_at"] = int(time())
 
     with session_scope() as session:
         try:
             session.query(YoutubeVideo).filter(YoutubeVideo.id == video.id).update(
-                {
-                    "vid_path": video.vid_path,
-                    "thumb_path": video.thumb_path,
-                    "downloaded_at": int(time()) if is_missing else video.downloaded_at,
-                    "size": size if is_missing else video.size,
-                    "keep": True,
-                }
+                values
             )
             session.commit()
             logger.info(f"Video - {video.title} was updated and will be kept")
@@ -31,6 +31,10 @@ class YoutubeVideo(Base):
     index_pub_date = Index("idx_pub_date", pub_date)
     index_downloaded_at = Index("idx_downloaded_at", downloaded_at)
     composite_index = Index("idx_filter_conditions", vid_path, short)
+    index_recent_videos = Index("idx_recent_videos", short, downloaded_at)
+    index_recent_shorts = Index(
+        "idx_recent_shorts", short, livestream, pub_date, vid_path
+    )
 
 
 class JsonData(Base):
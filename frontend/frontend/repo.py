@@ -2,6 +2,9 @@ import logging as _logging
 import threading
 from time import time
 
+from sqlalchemy import false, select, true, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
 from frontend.engine import session_scope
 from frontend.logging import logging
 from frontend.models import MostRecentVideo, RSSFeedDate, YoutubeVideo
@@ -44,11 +47,22 @@ def get_recent_videos(page):
     try:
         with session_scope() as session:
             selection = (int(page) + 1) * 35
-            ordered_query = (
-                session.query(YoutubeVideo).filter(YoutubeVideo.short.is_(False))
-            ).order_by(YoutubeVideo.downloaded_at.desc())
+            # the offset walks the index only, full rows are read for the page itself
+            page_ids = (
+                select(YoutubeVideo.id)
+                .where(YoutubeVideo.short == false())
+                .order_by(YoutubeVideo.downloaded_at.desc())
+                .limit(35)
+                .offset(selection - 35)
+                .subquery()
+            )
 
-            data = ordered_query.limit(35).offset(selection - 35).all()
+            data = (
+                session.query(YoutubeVideo)
+                .join(page_ids, YoutubeVideo.id == page_ids.c.id)
+                .order_by(YoutubeVideo.downloaded_at.desc())
+                .all()
+            )
             return data
     except Exception as error:
         logger.warn(
@@ -61,14 +75,21 @@ def get_recent_shorts(page):
     try:
         with session_scope() as session:
             selection = (int(page) + 1) * 35
-            data = (
-                session.query(YoutubeVideo)
-                .filter(YoutubeVideo.vid_path != "NA")
-                .filter(YoutubeVideo.short.is_(True))
-                .filter(YoutubeVideo.livestream.is_(False))
+            page_ids = (
+                select(YoutubeVideo.id)
+                .where(YoutubeVideo.vid_path != "NA")
+                .where(YoutubeVideo.short == true())
+                .where(YoutubeVideo.livestream == false())
                 .order_by(YoutubeVideo.pub_date.desc())
                 .limit(35)
                 .offset(selection - 35)
+                .subquery()
+            )
+
+            data = (
+                session.query(YoutubeVideo)
+                .join(page_ids, YoutubeVideo.id == page_ids.c.id)
+                .order_by(YoutubeVideo.pub_date.desc())
                 .all()
             )
             return data
@@ -100,8 +121,11 @@ def get_rss_date():
 def update_video_progress(id, progress):
     try:
         with session_scope() as session:
-            updated_rec = session.query(YoutubeVideo).filter_by(id=id).first()
-            updated_rec.progress_seconds = progress
+            session.execute(
+                update(YoutubeVideo)
+                .where(YoutubeVideo.id == id)
+                .values(progress_seconds=progress)
+            )
             session.commit()
 
         t1 = threading.Thread(target=create_or_update_most_recent_video, args=(id,))
@@ -113,12 +137,15 @@ def update_video_progress(id, progress):
 def create_or_update_most_recent_video(id):
     try:
         with session_scope() as session:
-            video = session.query(MostRecentVideo).filter_by(vid_id=id).first()
-            if video:
-                video.updated_at = int(time())
-            else:
-                new_video = MostRecentVideo(vid_id=id, updated_at=int(time()))
-                session.add(new_video)
+            # vid_id is unique, so the existence check is left to the database
+            statement = mysql_insert(MostRecentVideo).values(
+                vid_id=id, updated_at=int(time())
+            )
+            session.execute(
+                statement.on_duplicate_key_update(
+                    updated_at=statement.inserted.updated_at
+                )
+            )
             session.commit()
     except Exception as error:
         logger.error(
@@ -1,6 +1,8 @@
 import datetime
 import logging as _logging
+import os
 import threading
+from functools import lru_cache
 
 import feedparser
 import opml
@@ -55,15 +57,22 @@ def place_value(number):
 
 
 def get_all_channels():
-    data = open(f"{DATA_FOLDER}/subscription_manager", "r")
+    path = f"{DATA_FOLDER}/subscription_manager"
+    stat = os.stat(path)
+    # the subscriptions rarely change, parse them again only when the file does
+    return read_channels(path, stat.st_mtime_ns, stat.st_size)
 
-    nested = opml.parse(data)
+
+@lru_cache(maxsize=1)
+def read_channels(path, mtime, size):
+    with open(path, "r") as data:
+        nested = opml.parse(data)
 
     all_channels = list()
     for channel in nested[0]:
         real_id = channel.xmlUrl.split("=")[1]
         all_channels.append((channel.title, real_id))
-    return all_channels
+    return tuple(all_channels)
 
 
 def is_valid_url(feed_url):